@@ -0,0 +1,60 @@
+import json
+import argparse
+import timeit
+import numpy as np
+import pandas as pd
+from decoders import DECODERS, get_decoder
+
+
+def synthetic_page(bars=50000, seed=0):
+    "A page shaped like /v2/aggs minute results, used when no recorded page is given"
+    rng = np.random.default_rng(seed)
+    close = 100 + rng.standard_normal(bars).cumsum() * 0.05
+    start = 1704205800000
+    results = [
+        {
+            'v': float(rng.integers(100, 50000)), 'vw': round(c + 0.01, 4), 'o': round(c - 0.02, 4),
+            'c': round(c, 4), 'h': round(c + 0.05, 4), 'l': round(c - 0.05, 4),
+            't': start + i * 60000, 'n': int(rng.integers(1, 500)),
+        }
+        for i, c in enumerate(close)
+    ]
+    page = {'ticker': 'SPY', 'queryCount': bars, 'resultsCount': bars, 'adjusted': True,
+            'results': results, 'status': 'OK', 'request_id': 'bench', 'count': bars}
+    return json.dumps(page).encode()
+
+
+def baseline(content):
+    "What fetch_data did before decoders.py: response.json() then a DataFrame from a list of dicts"
+    return pd.DataFrame(json.loads(content).get('results', []))
+
+
+def run(content, repeat):
+    timings = {'json + DataFrame(list of dicts)': min(timeit.repeat(lambda: baseline(content), number=1, repeat=repeat))}
+    for name in DECODERS:
+        try:
+            decoder = get_decoder(name)
+        except ImportError:
+            continue
+        timings[f'{name} columns + DataFrame'] = min(timeit.repeat(
+            lambda: pd.DataFrame(decoder.decode_columns(content, 'aggs')[0]), number=1, repeat=repeat))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark decoding a page of aggregate bars.")
+    parser.add_argument('--page', help="Path to a recorded /v2/aggs response, defaults to a synthetic 50k-bar page")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page, 'rb') as f:
+            content = f.read()
+    else:
+        content = synthetic_page()
+
+    timings = run(content, args.repeat)
+    base = timings['json + DataFrame(list of dicts)']
+    print(f"{len(content) / 1e6:.1f} MB page")
+    for name, seconds in timings.items():
+        print(f"{name:<36} {seconds * 1000:8.1f} ms  {base / seconds:5.2f}x")
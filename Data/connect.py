@@ -1,10 +1,11 @@
-from sqlalchemy import create_engine, text, Integer, String, Float, DateTime, BigInteger, UniqueConstraint
+from sqlalchemy import create_engine, text, Integer, String, Float, DateTime, BigInteger, UniqueConstraint, Index, SmallInteger, Computed, REAL
 from dotenv import load_dotenv
 import os
+import json
 import asyncio
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from datetime import datetime
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, ARRAY
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 
 
@@ -18,12 +19,37 @@ host = os.getenv("DATABASE_HOST")
 port = os.getenv("DATABASE_PORT")
 database = os.getenv("DATABASE_NAME")
 
+# JSONB values are passed as Python objects and serialized once here; the asyncpg
+# dialect then sends the text through its binary jsonb codec
+try:
+    import orjson
+    json_serializer = lambda obj: orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    json_deserializer = orjson.loads
+except ImportError:
+    json_serializer = json.dumps
+    json_deserializer = json.loads
+
 # Create an async engine
-engine = create_async_engine(f'postgresql+asyncpg://{username}:{password}@{host}:{port}/{database}')
+engine = create_async_engine(
+    f'postgresql+asyncpg://{username}:{password}@{host}:{port}/{database}',
+    json_serializer=json_serializer,
+    json_deserializer=json_deserializer,
+)
 
 # Define sessionmaker
 AsyncSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
+# Text indexed for news full-text search, shared by the model and the migration in news_index.py
+NEWS_SEARCH_EXPRESSION = "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+# StockNews.sentiment_score for each sentiment label, used by NewsUpdate and the backfill in news_index.py
+SENTIMENT_SCORES = {'positive': 1, 'neutral': 0, 'negative': -1}
+
+# Insert time (UTC) of rows in the upserted tables, set on first insert and never updated: upserts leave
+# it alone on conflict, so it records when a key was first seen and lets RevisionTracker.as_of drop rows
+# that arrived later
+INGESTED_AT_DEFAULT = text("timezone('utc', now())")
+
 # Base class for the models
 class Base(DeclarativeBase):
     pass
@@ -43,6 +69,7 @@ class DailyStockData(Base):
     volume: Mapped[float] = mapped_column(Float)
     vwap: Mapped[float] = mapped_column(Float)
     transactions: Mapped[int] = mapped_column(Integer)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
     __table_args__ = (
         UniqueConstraint('ticker', 'date', name='unique_daily_ticker_date'),
     )
@@ -61,6 +88,7 @@ class HourlyStockData(Base):
     volume: Mapped[float] = mapped_column(Float)
     vwap: Mapped[float] = mapped_column(Float)
     transactions: Mapped[int] = mapped_column(Integer)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
     __table_args__ = (
         UniqueConstraint('ticker', 'date', name='unique_hourly_ticker_date'),
     )
@@ -79,6 +107,7 @@ class OneMinuteStockData(Base):
     volume: Mapped[float] = mapped_column(Float)
     vwap: Mapped[float] = mapped_column(Float)
     transactions: Mapped[int] = mapped_column(Integer)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
     __table_args__ = (
         UniqueConstraint('ticker', 'date', name='unique_one_minute_ticker_date'),
     )
@@ -97,6 +126,7 @@ class FiveMinuteStockData(Base):
     volume: Mapped[float] = mapped_column(Float)
     vwap: Mapped[float] = mapped_column(Float)
     transactions: Mapped[int] = mapped_column(Integer)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
     __table_args__ = (
         UniqueConstraint('ticker', 'date', name='unique_five_minute_ticker_date'),
     )
@@ -115,6 +145,7 @@ class FifteenMinuteStockData(Base):
     volume: Mapped[float] = mapped_column(Float)
     vwap: Mapped[float] = mapped_column(Float)
     transactions: Mapped[int] = mapped_column(Integer)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
     __table_args__ = (
         UniqueConstraint('ticker', 'date', name='unique_fifteen_minute_ticker_date'),
     )
@@ -128,6 +159,7 @@ class StockSplits(Base):
     split_from: Mapped[int] = mapped_column(Integer, nullable=False)
     split_to: Mapped[int] = mapped_column(Integer, nullable=False)
     ticker: Mapped[str] = mapped_column(String(10), nullable=False)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
     
     __table_args__ = (
         UniqueConstraint('ticker', 'execution_date', name='unique_ticker_execution_date'),
@@ -147,9 +179,17 @@ class StockNews(Base):
     ticker_queried: Mapped[str] = mapped_column(String(10), nullable=False, index=True)
     title: Mapped[str] = mapped_column(String, nullable=True)
     insights: Mapped[JSONB] = mapped_column(JSONB, nullable=True)  
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
+    sentiment: Mapped[str] = mapped_column(String(16), nullable=True)  # insight for ticker_queried
+    sentiment_score: Mapped[int] = mapped_column(SmallInteger, nullable=True)  # 1 positive, 0 neutral, -1 negative
+    search_vector: Mapped[str] = mapped_column(TSVECTOR, Computed(NEWS_SEARCH_EXPRESSION, persisted=True), nullable=True)
     
     __table_args__ = (
         UniqueConstraint('published_utc', 'ticker_queried', name='unique_published_ticker'),
+        Index('ix_stock_news_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_stock_news_tickers', 'tickers', postgresql_using='gin', postgresql_ops={'tickers': 'jsonb_path_ops'}),
+        Index('ix_stock_news_keywords', 'keywords', postgresql_using='gin', postgresql_ops={'keywords': 'jsonb_path_ops'}),
+        Index('ix_stock_news_published_id', 'published_utc', 'id'),
     )
 
     
@@ -168,6 +208,7 @@ class CompanyFinancials(Base):
     timeframe: Mapped[str] = mapped_column(String)
     tickers: Mapped[str] = mapped_column(String)
     sic: Mapped[int] = mapped_column(Integer, nullable=True)
+    ingested_at: Mapped[datetime] = mapped_column(DateTime, nullable=True, server_default=INGESTED_AT_DEFAULT)
 
     # __table_args__ = (
     #     UniqueConstraint('tickers', 'start_date', name='unique_ticker_start_date'),
@@ -201,6 +242,73 @@ class StockTrades(Base):
         UniqueConstraint('trade_id', 'date', name='unique_trade_date'),
     )
 
+class RevisionHistory(Base):
+    __tablename__ = 'revision_history'
+    ticker_column = 'ticker'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    table_name: Mapped[str] = mapped_column(String, nullable=False)
+    ticker: Mapped[str] = mapped_column(String, nullable=False)
+    valid_from: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # business date of the row (bar date, period start, ...)
+    key_extra: Mapped[str] = mapped_column(String, nullable=False, default='')  # remaining key columns, e.g. fiscal_period
+    row_hash: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    payload: Mapped[JSONB] = mapped_column(JSONB, nullable=False)  # the superseded values
+    recorded_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # when the values were superseded (UTC)
+
+    __table_args__ = (
+        Index('ix_revision_history_lookup', 'table_name', 'ticker', 'valid_from', 'recorded_at'),
+    )
+
+class ShardLease(Base):
+    __tablename__ = 'shard_leases'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    job: Mapped[str] = mapped_column(String, nullable=False)
+    shard: Mapped[int] = mapped_column(Integer, nullable=False)
+    shard_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    owner: Mapped[str] = mapped_column(String, nullable=False)  # host:pid of the worker holding the lease
+    status: Mapped[str] = mapped_column(String, nullable=False)  # running, done or failed
+    lease_expires: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('job', 'shard', name='unique_job_shard'),
+    )
+
+class TickerFeatures(Base):
+    __tablename__ = 'ticker_features'
+    ticker_column = 'ticker'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    source: Mapped[str] = mapped_column(String(32), nullable=False)  # bar table the features come from
+    ticker: Mapped[str] = mapped_column(String(10), nullable=False)
+    date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    ret: Mapped[float] = mapped_column(REAL)
+    log_ret: Mapped[float] = mapped_column(REAL)
+    volatility_20: Mapped[float] = mapped_column(REAL)  # std of log returns over 20 bars
+    adv_20: Mapped[float] = mapped_column(REAL)  # mean volume over 20 bars
+    vwap_dev: Mapped[float] = mapped_column(REAL)  # close / vwap - 1
+    vwap_dev_20: Mapped[float] = mapped_column(REAL)
+
+    __table_args__ = (
+        UniqueConstraint('source', 'ticker', 'date', name='unique_features_source_ticker_date'),
+    )
+
+class FeatureState(Base):
+    __tablename__ = 'feature_state'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    source: Mapped[str] = mapped_column(String(32), nullable=False)
+    ticker: Mapped[str] = mapped_column(String(10), nullable=False)
+    # The state stops one bar back: last_date is the newest bar seen, which the next run reads and
+    # recomputes in case it was still forming; last_close and the arrays are as of the bar before it
+    last_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_close: Mapped[float] = mapped_column(Float)
+    # Trailing window - 1 inputs of each rolling feature before last_date, carried into the next run
+    log_returns: Mapped[list] = mapped_column(ARRAY(Float), nullable=False)
+    volumes: Mapped[list] = mapped_column(ARRAY(Float), nullable=False)
+    vwap_devs: Mapped[list] = mapped_column(ARRAY(Float), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('source', 'ticker', name='unique_feature_state_source_ticker'),
+    )
+
 # Async functions for dropping and creating tables
 async def drop_tables():
     async with engine.begin() as conn:
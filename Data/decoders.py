@@ -0,0 +1,224 @@
+import os
+import json
+import logging
+from typing import Optional, Union
+from operator import attrgetter
+import numpy as np
+from log_config import setup_logging
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Setup logging
+setup_logging()
+
+# Fields kept from each endpoint; anything else in the payload is skipped while decoding
+AGG_FIELDS = ['t', 'o', 'h', 'l', 'c', 'v', 'vw', 'n']
+# Fixed dtypes for the typed path; missing or null prices become NaN, and n is widened to float
+# so a missing count can be NaN too, then narrowed back to int64 when the page has none missing
+AGG_DTYPES = {'t': np.int64, 'o': np.float64, 'h': np.float64, 'l': np.float64, 'c': np.float64,
+              'v': np.float64, 'vw': np.float64, 'n': np.float64}
+TRADE_FIELDS = ['conditions', 'exchange', 'id', 'participant_timestamp', 'price', 'sequence_number',
+                'sip_timestamp', 'size', 'tape', 'trf_id', 'trf_timestamp', 'correction']
+NEWS_FIELDS = ['published_utc', 'id', 'title', 'author', 'article_url', 'description', 'tickers', 'keywords', 'insights']
+SPLIT_FIELDS = ['execution_date', 'split_from', 'split_to', 'ticker']
+# Every decoder returns exactly these keys per record, whatever else the payload carries
+RECORD_FIELDS = {'aggs': AGG_FIELDS, 'news': NEWS_FIELDS, 'splits': SPLIT_FIELDS, 'trades': TRADE_FIELDS}
+
+
+if msgspec is not None:
+    # Field sets and order match the *_FIELDS lists above
+
+    class AggBar(msgspec.Struct, gc=False):
+        t: int
+        o: Optional[float] = None
+        h: Optional[float] = None
+        l: Optional[float] = None
+        c: Optional[float] = None
+        v: Optional[float] = None
+        vw: Optional[float] = None
+        n: Optional[float] = None
+
+    class NewsArticle(msgspec.Struct):
+        published_utc: str
+        id: Optional[str] = None
+        title: Optional[str] = None
+        author: Optional[str] = None
+        article_url: Optional[str] = None
+        description: Optional[str] = None
+        tickers: Optional[list[str]] = None
+        keywords: Optional[list[str]] = None
+        insights: Optional[list[dict]] = None
+
+    class Split(msgspec.Struct):
+        execution_date: str
+        split_from: Union[int, float]
+        split_to: Union[int, float]
+        ticker: Optional[str] = None
+
+    class Trade(msgspec.Struct, gc=False):
+        id: str
+        price: float
+        size: float
+        sip_timestamp: int
+        sequence_number: int
+        conditions: Optional[list[int]] = None
+        exchange: Optional[int] = None
+        participant_timestamp: Optional[int] = None
+        tape: Optional[int] = None
+        trf_id: Optional[int] = None
+        trf_timestamp: Optional[int] = None
+        correction: Optional[int] = None
+
+    class AggsPage(msgspec.Struct):
+        results: list[AggBar] = []
+        next_url: Optional[str] = None
+
+    class NewsPage(msgspec.Struct):
+        results: list[NewsArticle] = []
+        next_url: Optional[str] = None
+
+    class SplitsPage(msgspec.Struct):
+        results: list[Split] = []
+        next_url: Optional[str] = None
+
+    class TradesPage(msgspec.Struct):
+        results: list[Trade] = []
+        next_url: Optional[str] = None
+
+
+def to_column(values, dtype=None):
+    """1-D array from a list of field values.
+
+    With a dtype, None becomes NaN. Without one the array is object, so list-valued fields such as
+    trade conditions stay one entry per row whatever their lengths.
+    """
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def records_to_columns(records, fields, dtypes=None):
+    "Column arrays from a list of dicts, for decoders that have no typed path; one pass per field"
+    dtypes = dtypes or {}
+    return {field: to_column([record.get(field) for record in records], dtypes.get(field)) for field in fields}
+
+
+def structs_to_columns(structs, fields, dtypes=None):
+    dtypes = dtypes or {}
+    return {field: to_column(list(map(attrgetter(field), structs)), dtypes.get(field)) for field in fields}
+
+
+def narrow_agg_columns(columns):
+    "n back to int64 when no bar on the page is missing its trade count"
+    if not np.isnan(columns['n']).any():
+        columns['n'] = columns['n'].astype(np.int64)
+    return columns
+
+
+def concat_columns(pages):
+    "Join the column dicts of several pages; returns {} when there is nothing to join"
+    pages = [page for page in pages if page]
+    if not pages:
+        return {}
+    return {field: np.concatenate([page[field] for page in pages]) for field in pages[0]}
+
+
+class StdlibDecoder:
+    "Reference decoder built on the json module"
+    name = 'json'
+    column_fields = {'aggs': AGG_FIELDS, 'trades': TRADE_FIELDS}
+
+    def loads(self, content):
+        return json.loads(content)
+
+    def decode_records(self, content, kind):
+        "Returns (list of result dicts, next_url) for a page of the given endpoint"
+        data = self.loads(content)
+        results = data.get('results', []) or []
+        if kind in RECORD_FIELDS:
+            fields = RECORD_FIELDS[kind]
+            results = [{field: record.get(field) for field in fields} for record in results]
+        return results, data.get('next_url')
+
+    def decode_columns(self, content, kind):
+        "Returns ({field: array}, next_url); only aggs and trades have a columnar layout"
+        # Columns are read straight off the parsed results, without the filtered copy decode_records makes
+        data = self.loads(content)
+        records, next_url = data.get('results', []) or [], data.get('next_url')
+        if not records:
+            return {}, next_url
+        if kind == 'aggs':
+            return narrow_agg_columns(records_to_columns(records, AGG_FIELDS, AGG_DTYPES)), next_url
+        return records_to_columns(records, self.column_fields[kind]), next_url
+
+
+class OrjsonDecoder(StdlibDecoder):
+    name = 'orjson'
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+class MsgspecDecoder(StdlibDecoder):
+    "Decodes straight into typed structs, skipping every field the tables don't use"
+    name = 'msgspec'
+
+    def __init__(self):
+        self.generic = msgspec.json.Decoder()
+        self.typed = {
+            'aggs': msgspec.json.Decoder(AggsPage),
+            'news': msgspec.json.Decoder(NewsPage),
+            'splits': msgspec.json.Decoder(SplitsPage),
+            'trades': msgspec.json.Decoder(TradesPage),
+        }
+
+    def loads(self, content):
+        return self.generic.decode(content)
+
+    def decode_records(self, content, kind):
+        if kind not in self.typed:
+            return super().decode_records(content, kind)
+        page = self.typed[kind].decode(content)
+        return [msgspec.structs.asdict(r) for r in page.results], page.next_url
+
+    def decode_columns(self, content, kind):
+        page = self.typed[kind].decode(content)
+        if not page.results:
+            return {}, page.next_url
+        if kind != 'aggs':
+            return structs_to_columns(page.results, self.column_fields[kind]), page.next_url
+
+        return narrow_agg_columns(structs_to_columns(page.results, AGG_FIELDS, AGG_DTYPES)), page.next_url
+
+
+DECODERS = {
+    'msgspec': MsgspecDecoder,
+    'orjson': OrjsonDecoder,
+    'json': StdlibDecoder,
+}
+
+
+def get_decoder(name=None):
+    """Return a decoder by name, or the fastest one installed.
+
+    The JSON_DECODER environment variable overrides the default choice.
+    """
+    name = name or os.getenv("JSON_DECODER")
+    if name is None:
+        name = 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+    if name not in DECODERS:
+        raise ValueError(f"Decoder {name} is not valid. Valid decoders are {', '.join(DECODERS)}.")
+    if (name == 'msgspec' and msgspec is None) or (name == 'orjson' and orjson is None):
+        raise ImportError(f"Decoder {name} requested but the {name} package is not installed.")
+    logging.debug(f"Using {name} JSON decoder.")
+    return DECODERS[name]()
@@ -0,0 +1,170 @@
+import pandas as pd
+import numpy as np
+import logging
+from sqlalchemy import select, and_
+from sqlalchemy.dialects.postgresql import insert
+from connect import TickerFeatures, FeatureState
+from log_config import setup_logging
+
+# Setup logging
+setup_logging()
+
+# Fixed, as the feature columns are named after it and one table holds every run's rows
+WINDOW = 20
+FEATURE_COLUMNS = ['ret', 'log_ret', 'volatility_20', 'adv_20', 'vwap_dev', 'vwap_dev_20']
+
+
+def rolling_mean_std(history, values, window=WINDOW):
+    """Rolling mean and sample std of `values` over `window` points.
+
+    `history` holds the values that preceded `values` (the carried state), so the first outputs use
+    a full window without re-reading old bars. NaNs are skipped; a window with fewer than `window`
+    valid points gives NaN. Returns the new (mean, std) and the last `window` values, the tail of
+    which is the history to carry into the next run.
+    """
+    x = np.concatenate([np.asarray(history, dtype=np.float64), np.asarray(values, dtype=np.float64)])
+    valid = ~np.isnan(x)
+    filled = np.where(valid, x, 0.0)
+
+    # Prefix sums turn every window sum into a difference of two entries
+    c0 = np.concatenate([[0], np.cumsum(valid)])
+    c1 = np.concatenate([[0.0], np.cumsum(filled)])
+    c2 = np.concatenate([[0.0], np.cumsum(filled * filled)])
+
+    end = np.arange(len(history) + 1, len(x) + 1)
+    start = np.maximum(end - window, 0)
+    count = c0[end] - c0[start]
+    s1 = c1[end] - c1[start]
+    s2 = c2[end] - c2[start]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s1 / count
+        var = (s2 - s1 * mean) / (count - 1)
+    full = count >= window
+    mean = np.where(full, mean, np.nan)
+    std = np.where(full, np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return mean, std, x[-window:]
+
+
+class FeatureStore:
+    "Rolling per-ticker features kept up to date from the bar tables, one run's new bars at a time"
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    async def load_state(self, conn, source, tickers):
+        query = select(FeatureState).where(FeatureState.source == source, FeatureState.ticker.in_(tickers))
+        result = await conn.execute(query)
+        return {state.ticker: state for state in result.all()}
+
+    def compute(self, bars, state):
+        "Features for new bars only, given the carried state (None on the first run)"
+        close = bars['close'].to_numpy(dtype=np.float64)
+        volume = bars['volume'].to_numpy(dtype=np.float64)
+        vwap = bars['vwap'].to_numpy(dtype=np.float64)
+
+        previous_close = state.last_close if state is not None and state.last_close is not None else np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_ret = np.diff(np.log(np.concatenate([[previous_close], close])))
+            vwap_dev = close / vwap - 1
+
+        _, volatility, log_returns = rolling_mean_std(state.log_returns if state is not None else [], log_ret)
+        adv, _, volumes = rolling_mean_std(state.volumes if state is not None else [], volume)
+        vwap_dev_mean, _, vwap_devs = rolling_mean_std(state.vwap_devs if state is not None else [], vwap_dev)
+
+        features = pd.DataFrame({
+            'date': bars['date'],
+            'ret': np.expm1(log_ret),
+            'log_ret': log_ret,
+            'volatility_20': volatility,
+            'adv_20': adv,
+            'vwap_dev': vwap_dev,
+            'vwap_dev_20': vwap_dev_mean,
+        })
+        # State one bar back, so the newest bar is recomputed from scratch next run
+        new_state = {
+            'last_date': bars['date'].iloc[-1],
+            'last_close': float(close[-2]) if len(close) > 1 else previous_close,
+            'log_returns': log_returns[:-1].tolist(),
+            'volumes': volumes[:-1].tolist(),
+            'vwap_devs': vwap_devs[:-1].tolist(),
+        }
+        return features, new_state
+
+    async def update(self, conn, model, tickers):
+        """Upsert features for the bars added to `model` since the last run and commit.
+
+        Reading starts at each ticker's stored last_date, inclusive: the newest bar of the previous run
+        may have been a forming bar that update_data has since rewritten, so it is recomputed. Older
+        restated bars are not reflected until the ticker's state row is deleted and it is rebuilt.
+        Returns False if the update failed and was rolled back.
+        """
+        source = model.__tablename__
+        states = await self.load_state(conn, source, tickers)
+        total = 0
+
+        try:
+            for ticker in tickers:
+                state = states.get(ticker)
+                query = select(model.date, model.close, model.volume, model.vwap).where(model.ticker == ticker)
+                if state is not None:
+                    query = query.where(model.date >= state.last_date)
+                result = await conn.execute(query.order_by(model.date))
+                bars = pd.DataFrame(result.all(), columns=['date', 'close', 'volume', 'vwap'])
+                if bars.empty:
+                    continue
+
+                features, new_state = self.compute(bars, state)
+                features.insert(0, 'ticker', ticker)
+                features.insert(0, 'source', source)
+                records = features.astype(object).where(features.notna(), None).to_dict(orient='records')
+
+                table = TickerFeatures.__table__
+                for i in range(0, len(records), self.batch_size):
+                    stmt = insert(table).values(records[i:i + self.batch_size])
+                    update_dict = {c.name: c for c in stmt.excluded if c.name in FEATURE_COLUMNS}
+                    stmt = stmt.on_conflict_do_update(index_elements=['source', 'ticker', 'date'], set_=update_dict)
+                    await conn.execute(stmt)
+
+                stmt = insert(FeatureState.__table__).values(source=source, ticker=ticker, **new_state)
+                update_dict = {c.name: c for c in stmt.excluded if c.name not in ['id', 'source', 'ticker']}
+                stmt = stmt.on_conflict_do_update(index_elements=['source', 'ticker'], set_=update_dict)
+                await conn.execute(stmt)
+                total += len(records)
+
+            await conn.commit()
+            logging.info(f"Features updated for {total} {source} bars")
+            return True
+        except Exception as e:
+            logging.error(f"Error updating features for {source}: {e}")
+            await conn.rollback()
+            return False
+
+    async def latest(self, conn, model, tickers=None):
+        "Most recent feature row per ticker, for the whole universe when tickers is None"
+        # feature_state has one row per ticker pointing at its newest bar, so each lookup is a unique index hit
+        query = self.select_features(model, tickers).join(FeatureState, and_(
+            FeatureState.source == TickerFeatures.source,
+            FeatureState.ticker == TickerFeatures.ticker,
+            FeatureState.last_date == TickerFeatures.date,
+        ))
+        return await self.read(conn, query.order_by(TickerFeatures.ticker))
+
+    async def history(self, conn, model, tickers=None, start=None, end=None):
+        query = self.select_features(model, tickers)
+        if start is not None:
+            query = query.where(TickerFeatures.date >= start)
+        if end is not None:
+            query = query.where(TickerFeatures.date <= end)
+        return await self.read(conn, query.order_by(TickerFeatures.ticker, TickerFeatures.date))
+
+    def select_features(self, model, tickers):
+        columns = [TickerFeatures.__table__.c[c] for c in ['ticker', 'date'] + FEATURE_COLUMNS]
+        query = select(*columns).where(TickerFeatures.source == model.__tablename__)
+        if tickers is not None:
+            query = query.where(TickerFeatures.ticker.in_(tickers))
+        return query
+
+    async def read(self, conn, query):
+        result = await conn.execute(query)
+        return pd.DataFrame(result.all(), columns=['ticker', 'date'] + FEATURE_COLUMNS)
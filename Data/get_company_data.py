@@ -11,7 +11,8 @@ from sqlalchemy.sql import func
 import logging
 from sqlalchemy.dialects.postgresql import JSONB, insert
 from log_config import setup_logging
-import json
+from revisions import RevisionTracker
+from decoders import get_decoder
 import asyncio
 import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -22,10 +23,14 @@ setup_logging()
 load_dotenv()
 
 class CompanyFinancialsupdater:
-    def __init__(self, tickers, engine, key):
+    def __init__(self, tickers, engine, key, track_revisions=False, decoder=None, concurrency=8):
         self.tickers = tickers if isinstance(tickers, list) else [tickers]
         self.engine = engine
         self.key = key
+        self.concurrency = concurrency  # tickers downloading at once; also bounds how many wait to be written
+        self.failures = 0
+        self.revision_tracker = RevisionTracker(CompanyFinancials) if track_revisions else None
+        self.decoder = decoder or get_decoder()
     
     async def transform_data(self, df):
         logging.info(f"Transforming data for {len(df)} records")
@@ -51,11 +56,7 @@ class CompanyFinancialsupdater:
         columns_to_drop = ['cik', 'source_filing_file_url', 'source_filing_url']
         df = df.drop(columns=[col for col in columns_to_drop if col in df.columns])
 
-        logging.info(f"Data after dropping unnecessary columns: {df.head()}")
-
-        # Convert financials to JSON string
-        if 'financials' in df.columns:
-            df['financials'] = df['financials'].apply(json.dumps)
+        # financials stays a dict: the engine's JSONB codec serializes it once on the way to Postgres
 
         # df = df.drop_duplicates(subset=['start_date', 'tickers'], keep='last')
 
@@ -78,71 +79,101 @@ class CompanyFinancialsupdater:
                 try:
                     response = await async_client.get(url, params=params)
                     response.raise_for_status()  # Ensure we handle any HTTP errors
-                    data = response.json()
-
                     # Add current page of data to the list
-                    results = data.get('results', [])
+                    results, url = self.decoder.decode_records(response.content, 'financials')  # If no next_url, this will stop the loop
                     all_results.extend(results)
 
-                    url = data.get('next_url', None)  # If no next_url, this will stop the loop
-
                     logging.info(f"Fetched {len(results)} records for {ticker}, moving to next page.")
 
                 except httpx.HTTPStatusError as e:
                     logging.error(f"HTTP error occurred: {e}")
+                    self.failures += 1
                     break
                 except Exception as e:
                     logging.error(f"An error occurred: {e}")
+                    self.failures += 1
                     break
 
         return all_results
 
+    async def fetch_all(self, tickers, queue):
+        # Producers share one iterator, so each ticker is fetched once; (None, None) marks this producer
+        # done, sent even if it fails so update_data stops waiting for it
+        try:
+            for ticker in tickers:
+                await queue.put((ticker, await self.fetch_data(ticker)))
+        except Exception as e:
+            logging.error(f"Error fetching company data: {e}")
+            self.failures += 1
+        finally:
+            await queue.put((None, None))
+
+    async def write_data(self, conn, ticker, records):
+        try:
+            if self.revision_tracker:
+                await self.revision_tracker.record(conn, records)
+            table = CompanyFinancials.__table__
+            batch_size = 1000
+            for i in range(0, len(records), batch_size):
+                batch_data = records[i:i + batch_size]
+
+                stmt = insert(table).values(batch_data)
+                # Dictionary for the columns to update in case of conflict
+                update_dict = {c.name: c for c in stmt.excluded if c.name not in ['id', 'ingested_at', 'tickers', 'start_date', 'fiscal_period']}
+
+                # Add conflict handling
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['tickers', 'start_date', 'fiscal_period'],  # Include fiscal_period
+                    set_=update_dict  # Use the prebuilt update dictionary
+                )
+
+                await conn.execute(stmt)
+            await conn.commit()
+            logging.info(f"Data successfully updated for {len(records)} records of {ticker}")
+            return len(records)
+        except Exception as e:
+            logging.error(f"Error updating company data for {ticker}: {e}")
+            self.failures += 1
+            await conn.rollback()
+            return 0
+
     async def update_data(self):
-        all_data = []
+        "Stream filings ticker by ticker into company_financials; returns False if any ticker failed to fetch or write"
+        self.failures = 0
+        total = 0
         logging.info(f"Updating company financials for {self.tickers}")
 
-        async with self.engine.connect() as conn:
-            tasks = []
-            for ticker in self.tickers:
-                tasks.append(self.fetch_data(ticker))
-            
-            responses = await asyncio.gather(*tasks)
-            
-            for response, ticker in zip(responses, self.tickers):
-                if response:
-                    ticker_df = pd.DataFrame(response)
-                    if not ticker_df.empty:
-                        transformed_data = await self.transform_data(ticker_df)
-                        all_data.extend(transformed_data)
-                    else:
+        # `concurrency` tickers download at once and filings are transformed and flushed per ticker,
+        # so memory is bounded by a few tickers' history instead of the whole universe's
+        tickers = iter(self.tickers)
+        queue = asyncio.Queue(maxsize=self.concurrency)
+        producers = [asyncio.create_task(self.fetch_all(tickers, queue)) for _ in range(self.concurrency)]
+
+        try:
+            async with self.engine.connect() as conn:
+                running = len(producers)
+                while running:
+                    ticker, response = await queue.get()
+                    if ticker is None:
+                        running -= 1
+                        continue
+                    if not response:
                         logging.info(f"No data for {ticker}")
-
-            if all_data:
-                logging.debug(f'Inserting data into the database for {len(all_data)} records.')
-                try:
-                    table = CompanyFinancials.__table__
-                    batch_size = 1000
-                    for i in range(0, len(all_data), batch_size):
-                        batch_data = all_data[i:i + batch_size]
-                        
-                        stmt = insert(table).values(batch_data)
-                        # Dictionary for the columns to update in case of conflict
-                        update_dict = {c.name: c for c in CompanyFinancials.__table__.columns if c.name not in ['tickers', 'start_date', 'fiscal_period']}
-                        
-                        # Add conflict handling
-                        stmt = stmt.on_conflict_do_update(
-                            index_elements=['tickers', 'start_date', 'fiscal_period'],  # Include fiscal_period
-                            set_=update_dict  # Use the prebuilt update dictionary
-                        )
-                        
-                        await conn.execute(stmt)
-                    await conn.commit()
-                    logging.info(f"Data successfully updated for {len(all_data)} records")
-                except Exception as e:
-                    logging.error(f"Error updating company data: {e}")
-                    await conn.rollback()
-            else:
-                logging.info("No data to update.")
+                        continue
+
+                    records = await self.transform_data(pd.DataFrame(response))
+                    del response
+                    total += await self.write_data(conn, ticker, records)
+            await asyncio.gather(*producers)
+        finally:
+            for producer in producers:
+                producer.cancel()
+
+        if total:
+            logging.info(f"Company financials updated for {total} records")
+        else:
+            logging.info("No data to update.")
+        return self.failures == 0
 
 
 
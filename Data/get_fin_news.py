@@ -5,12 +5,14 @@ from datetime import datetime
 import datetime as dt
 import os
 from dotenv import load_dotenv
-from connect import engine, Base, StockNews
+from connect import engine, Base, StockNews, SENTIMENT_SCORES
 from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql import func
 import logging
 from log_config import setup_logging
+from revisions import RevisionTracker
+from decoders import get_decoder
 import pytz
 import asyncio
 import httpx
@@ -23,17 +25,25 @@ setup_logging()
 load_dotenv()
 
 class NewsUpdate:
-    def __init__(self, tickers, engine, key, limit=1000):
+    def __init__(self, tickers, engine, key, limit=1000, track_revisions=False, decoder=None):
         self.tickers = tickers if isinstance(tickers, list) else [tickers]
         self.engine = engine
         self.key = key
+        self.failures = 0
         self.limit = limit
+        self.revision_tracker = RevisionTracker(StockNews) if track_revisions else None
+        self.decoder = decoder or get_decoder()
         
     async def transform_data(self, ticker_df, ticker):
         ticker_df['published_utc'] = pd.to_datetime(ticker_df['published_utc'], errors='coerce').dt.tz_convert('UTC').dt.tz_localize(None)
         ticker_df['ticker_queried'] = ticker
         ticker_df.rename(columns={"id": "id_polygon"}, inplace=True)
         ticker_df.drop(columns=['amp_url', 'image_url', 'publisher'], inplace=True, errors='ignore')
+
+        # Sentiment of the queried ticker, pulled out of insights into typed columns
+        insights = ticker_df['insights'] if 'insights' in ticker_df.columns else [None] * len(ticker_df)
+        ticker_df['sentiment'] = pd.Series([self.extract_sentiment(i, ticker) for i in insights], index=ticker_df.index, dtype=object)
+        ticker_df['sentiment_score'] = pd.Series([SENTIMENT_SCORES.get(s) for s in ticker_df['sentiment']], index=ticker_df.index, dtype=object)
         
         # Replace NaN values with None
         for col in ticker_df.columns:
@@ -41,6 +51,15 @@ class NewsUpdate:
                 ticker_df[col] = ticker_df[col].replace({pd.NA: None, np.nan: None})
         
         return ticker_df.to_dict(orient='records')
+
+    @staticmethod
+    def extract_sentiment(insights, ticker):
+        if not isinstance(insights, list):
+            return None
+        for insight in insights:
+            if isinstance(insight, dict) and insight.get('ticker') == ticker:
+                return insight.get('sentiment')
+        return None
     
     async def fetch_data(self, ticker, last_date):
         params = {"limit": self.limit, "apiKey": self.key}
@@ -50,9 +69,12 @@ class NewsUpdate:
         url = f"https://api.polygon.io/v2/reference/news?ticker={ticker}"
         async with httpx.AsyncClient() as async_client:
             response = await async_client.get(url, params=params)
-            return response.json().get('results', [])
+            results, _ = self.decoder.decode_records(response.content, 'news')
+            return results
 
     async def update_data(self):
+        "Fetch and upsert news since each ticker's latest article; returns False if any fetch or write failed"
+        self.failures = 0
         all_data = []
         logging.info(f"Updating stock news for {self.tickers}")
 
@@ -66,6 +88,7 @@ class NewsUpdate:
                     tasks.append(self.fetch_data(ticker, last_date))
                 except Exception as e:
                     logging.error(f"Error preparing data for ticker {ticker}: {e}")
+                    self.failures += 1
 
             responses = await asyncio.gather(*tasks)
 
@@ -87,20 +110,26 @@ class NewsUpdate:
                     unique_data = {f"{item['published_utc']}_{item['ticker_queried']}": item for item in all_data}
                     all_data = list(unique_data.values())
 
+                    if self.revision_tracker:
+                        await self.revision_tracker.record(conn, all_data)
+
                     for i in range(0, len(all_data), batch_size):
                         batch_data = all_data[i:i + batch_size]
                         stmt = insert(table).values(batch_data)
-                        update_dict = {c.name: c for c in stmt.excluded if c.name not in ['published_utc', 'ticker_queried']}
+                        update_dict = {c.name: c for c in stmt.excluded if c.name not in ['id', 'ingested_at', 'search_vector', 'published_utc', 'ticker_queried']}
                         stmt = stmt.on_conflict_do_update(index_elements=['published_utc', 'ticker_queried'], set_=update_dict)
                         await conn.execute(stmt)
                     await conn.commit()
                     logging.info("Data insert completed successfully.")
                 except Exception as e:
                     logging.error(f"Error bulk updating stock news: {e}")
+                    self.failures += 1
                     await conn.rollback()
             else:
                 logging.info("No data to update.")
 
+        return self.failures == 0
+
 # if __name__ == '__main__':
 #     tickers = ['AAPL', 'MSFT']  # Example tickers
 #     key = os.getenv("API_KEY")
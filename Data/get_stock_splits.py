@@ -7,6 +7,8 @@ import os
 from dotenv import load_dotenv
 from connect import engine, Base, StockSplits
 from log_config import setup_logging
+from revisions import RevisionTracker
+from decoders import get_decoder
 from sqlalchemy import select, inspect
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
@@ -25,11 +27,14 @@ load_dotenv()
 class StockSplitsupdate:
     "Class to update stock split data from Polygon.io"
 
-    def __init__(self, tickers, engine, key, limit=1000):
+    def __init__(self, tickers, engine, key, limit=1000, track_revisions=False, decoder=None):
         self.tickers = tickers if isinstance(tickers, list) else [tickers]
         self.engine = engine
         self.key = key
+        self.failures = 0
         self.limit = limit
+        self.revision_tracker = RevisionTracker(StockSplits) if track_revisions else None
+        self.decoder = decoder or get_decoder()
         
     async def transform_data(self, df, ticker):
         df['ticker'] = ticker
@@ -42,9 +47,12 @@ class StockSplitsupdate:
         async with httpx.AsyncClient() as async_client:
             response = await async_client.get(url, params=params)
             response.raise_for_status()
-            return response.json().get('results', [])
+            results, _ = self.decoder.decode_records(response.content, 'splits')
+            return results
      
     async def update_data(self):
+        "Fetch and upsert splits for every ticker; returns False if any fetch or write failed"
+        self.failures = 0
         all_data = []
         logging.info(f"Updating stock splits for {self.tickers}")
 
@@ -63,17 +71,22 @@ class StockSplitsupdate:
 
             if all_data:
                 try:
+                    if self.revision_tracker:
+                        await self.revision_tracker.record(conn, all_data)
                     table = StockSplits.__table__
                     stmt = insert(table).values(all_data)
-                    update_dict = {c.name: c for c in stmt.excluded if c.name not in ['ticker', 'execution_date']}
+                    update_dict = {c.name: c for c in stmt.excluded if c.name not in ['ingested_at', 'ticker', 'execution_date']}
                     stmt = stmt.on_conflict_do_update(index_elements=['ticker', 'execution_date'], set_=update_dict)
                     await conn.execute(stmt)
                     await conn.commit()
                     logging.info("Data insert completed successfully.")
                 except Exception as e:
                     logging.error(f"Error updating stock splits data: {e}")
+                    self.failures += 1
                     await conn.rollback()
 
+        return self.failures == 0
+
 
 # if __name__ == '__main__':
 #     tickers = ['AAPL', 'MSFT']  
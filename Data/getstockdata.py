@@ -10,6 +10,8 @@ from sqlalchemy import select
 from sqlalchemy.sql import func
 import logging
 from log_config import setup_logging
+from revisions import RevisionTracker
+from decoders import get_decoder, concat_columns
 import pytz
 from sqlalchemy.dialects.postgresql import insert
 import asyncio
@@ -24,49 +26,58 @@ load_dotenv()
 
 
 class MarketDataUpdater:
-    def __init__(self, tickers, engine, key, start_date='2005-01-01', end_date=dt.date.today(), multiplier=1, timespan='day', limit=50000):
+    def __init__(self, tickers, engine, key, start_date='2005-01-01', end_date=dt.date.today(), multiplier=1, timespan='day', limit=50000, track_revisions=False, decoder=None, feature_store=None):
         self.tickers = tickers if isinstance(tickers, list) else [tickers]
         self.engine = engine
         self.key = key
+        self.failures = 0
         self.start_date = start_date
         self.end_date = end_date
         self.multiplier = multiplier
         self.timespan = timespan
         self.limit = limit
+        self.revision_tracker = RevisionTracker(self.get_table_name()) if track_revisions else None
+        self.decoder = decoder or get_decoder()
+        self.feature_store = feature_store
         logging.info(f"Initialized MarketDataUpdater with {len(self.tickers)} tickers.")
     
     
-    async def fetch_data(self, ticker, start_date):
-        all_results = []
-        current_url = f"https://api.polygon.io/v2/aggs/ticker/{ticker}/range/{self.multiplier}/{self.timespan}/{start_date}/{self.end_date}"
+    async def fetch_data(self, ticker, start_date, end_date=None, async_client=None):
+        # start_date/end_date may be 'YYYY-MM-DD' or a millisecond timestamp; pass async_client to reuse its connection pool
+        if async_client is None:
+            async with httpx.AsyncClient() as async_client:
+                return await self.fetch_data(ticker, start_date, end_date, async_client)
+
+        pages = []
+        end_date = end_date if end_date is not None else self.end_date
+        current_url = f"https://api.polygon.io/v2/aggs/ticker/{ticker}/range/{self.multiplier}/{self.timespan}/{start_date}/{end_date}"
         params = {"limit": self.limit, "apiKey": self.key}
-    
-        async with httpx.AsyncClient() as async_client:
-            while current_url:
-                try:
-                    response = await async_client.get(current_url, params=params)
-                    response.raise_for_status()
-                    data = response.json()
-                    results = data.get('results', [])
-                    
-                    if not results:
-                        break
 
-                    all_results.extend(results)
+        while current_url:
+            try:
+                response = await async_client.get(current_url, params=params)
+                response.raise_for_status()
+                # Aggregates are decoded into column arrays, one per field, instead of a dict per bar
+                results, current_url = self.decoder.decode_columns(response.content, 'aggs')
 
-                    current_url = data.get('next_url')
+                if not results:
+                    break
 
-                    if not current_url:
-                        break
+                pages.append(results)
 
-                except httpx.HTTPStatusError as e:
-                    logging.error(f"HTTP error occurred: {e}")
-                    break
-                except Exception as e:
-                    logging.error(f"An error occurred: {e}")
+                if not current_url:
                     break
 
-        return all_results
+            except httpx.HTTPStatusError as e:
+                logging.error(f"HTTP error occurred: {e}")
+                self.failures += 1
+                break
+            except Exception as e:
+                logging.error(f"An error occurred: {e}")
+                self.failures += 1
+                break
+
+        return concat_columns(pages)
 
 
     def get_table_name(self):
@@ -83,6 +94,8 @@ class MarketDataUpdater:
         return table_map[self.timespan]
 
     async def update_data(self):
+        "Fetch, upsert and (with a feature store) featurize new bars; returns False if any ticker, write or feature update failed"
+        self.failures = 0
         all_data = []
         logging.debug(f'Starting data update process for {len(self.tickers)} tickers.')
 
@@ -109,6 +122,7 @@ class MarketDataUpdater:
                     tasks.append(self.fetch_data(ticker, start_date))
                 except Exception as e:
                     logging.error(f"Error preparing data for ticker {ticker}: {e}")
+                    self.failures += 1
 
             responses = await asyncio.gather(*tasks)
 
@@ -125,22 +139,29 @@ class MarketDataUpdater:
             if all_data:
                 logging.debug(f'Inserting data into the database for {len(all_data)} records.')
                 try:
+                    if self.revision_tracker:
+                        await self.revision_tracker.record(conn, all_data)
                     table = StockDataClass.__table__
                     batch_size = 1000
                     for i in range(0, len(all_data), batch_size):
                         batch_data = all_data[i:i + batch_size]
                         stmt = insert(table).values(batch_data)
-                        update_dict = {c.name: c for c in stmt.excluded if c.name not in ['date', 'ticker']}
+                        update_dict = {c.name: c for c in stmt.excluded if c.name not in ['ingested_at', 'date', 'ticker']}
                         stmt = stmt.on_conflict_do_update(index_elements=['date', 'ticker'], set_=update_dict)
                         await conn.execute(stmt)
                     await conn.commit()
                     logging.info(f'Data successfully updated for {len(all_data)} records')
                 except Exception as e:
                     logging.error(f"Error updating stock data in bulk: {e}")
+                    self.failures += 1
                     await conn.rollback()
+
+                if self.feature_store and not await self.feature_store.update(conn, StockDataClass, self.tickers):
+                    self.failures += 1
             else:
                 logging.info("No data to update.")
 
+        return self.failures == 0
 
 
     async def transform_data(self, df, ticker):
@@ -0,0 +1,173 @@
+import pandas as pd
+import os
+import logging
+import asyncio
+import httpx
+import pytz
+from datetime import datetime, time
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert
+from connect import engine, OneMinuteStockData
+from getstockdata import MarketDataUpdater
+from log_config import setup_logging
+
+# Setup logging
+setup_logging()
+
+# Load environment variables
+load_dotenv()
+
+EASTERN = pytz.timezone('US/Eastern')
+BAR_MS = 60000
+
+
+class MinuteBarTail(MarketDataUpdater):
+    """Intraday tail for OneMinuteStockData.
+
+    Keeps the timestamp of the last stored bar per ticker and, while the market is open, only asks
+    Polygon for bars after it. Closed bars are appended once; subscribers get each batch as it lands.
+    """
+
+    def __init__(self, tickers, engine, key, poll_interval=5, extended_hours=False, decoder=None):
+        super().__init__(tickers, engine, key, timespan='minute', decoder=decoder)
+        self.poll_interval = poll_interval
+        self.extended_hours = extended_hours
+        self.high_water = {}  # ticker -> timestamp (ms) of the newest stored bar
+        self.subscribers = []
+
+    def session_bounds(self, day):
+        start, end = (time(4, 0), time(20, 0)) if self.extended_hours else (time(9, 30), time(16, 0))
+        return EASTERN.localize(datetime.combine(day, start)), EASTERN.localize(datetime.combine(day, end))
+
+    def market_open(self, now):
+        now = now.astimezone(EASTERN)
+        if now.weekday() >= 5:
+            return False
+        start, end = self.session_bounds(now.date())
+        return start <= now < end
+
+    async def load_high_water(self, conn, session_start):
+        "Called at every session open, so each session starts from its own open and not the previous close"
+        table = OneMinuteStockData
+        # Anything before the open is clamped below anyway, so only today's rows are read (dates are naive Eastern)
+        query = (
+            select(table.ticker, func.max(table.timestamp))
+            .where(table.ticker.in_(self.tickers), table.date >= session_start.replace(tzinfo=None))
+            .group_by(table.ticker)
+        )
+        result = await conn.execute(query)
+        stored = {ticker: timestamp for ticker, timestamp in result.all()}
+
+        # Never before this session's open: bars outside the session and missing history belong to the batch updater
+        session_start_ms = int(session_start.timestamp() * 1000)
+        for ticker in self.tickers:
+            self.high_water[ticker] = max(stored.get(ticker) or 0, self.high_water.get(ticker) or 0, session_start_ms - 1)
+        logging.info(f"Loaded high-water marks for {len(self.tickers)} tickers from {session_start}.")
+
+    def subscribe(self, maxsize=1000):
+        "Queue of (ticker, DataFrame of new bars); when full the oldest batch is dropped so ingest never waits"
+        queue = asyncio.Queue(maxsize)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    async def bars(self, maxsize=1000):
+        "Async iterator over (ticker, DataFrame) batches of new bars"
+        queue = self.subscribe(maxsize)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(queue)
+
+    def publish(self, ticker, df):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((ticker, df))
+
+    async def poll_ticker(self, async_client, ticker, now_ms):
+        response = await self.fetch_data(ticker, self.high_water[ticker] + 1, now_ms, async_client)
+        if not response:
+            return None
+        df = pd.DataFrame(response)
+        # Only closed bars: a bar still forming would be skipped for good once the mark moves past it
+        df = df[(df['t'] > self.high_water[ticker]) & (df['t'] + BAR_MS <= now_ms)]
+        if df.empty:
+            return None
+        return df.drop_duplicates(subset=['t'], keep='last').sort_values('t')
+
+    async def poll_once(self, conn, async_client):
+        now_ms = int(datetime.now(pytz.utc).timestamp() * 1000)
+        responses = await asyncio.gather(*[self.poll_ticker(async_client, ticker, now_ms) for ticker in self.tickers])
+
+        new_bars = {}
+        for ticker, df in zip(self.tickers, responses):
+            if df is not None:
+                new_bars[ticker] = (int(df['t'].iloc[-1]), await self.transform_data(df, ticker))
+        all_data = [record for _, records in new_bars.values() for record in records]
+        if not all_data:
+            return 0
+
+        try:
+            # New bars only, so a plain append: existing rows are never rewritten
+            table = OneMinuteStockData.__table__
+            batch_size = 1000
+            for i in range(0, len(all_data), batch_size):
+                stmt = insert(table).values(all_data[i:i + batch_size])
+                stmt = stmt.on_conflict_do_nothing(index_elements=['date', 'ticker'])
+                await conn.execute(stmt)
+            await conn.commit()
+        except Exception as e:
+            # The connection is discarded after each poll, so there is nothing to roll back here
+            logging.error(f"Error appending live minute bars: {e}")
+            self.failures += 1
+            return 0
+
+        for ticker, (last_timestamp, records) in new_bars.items():
+            self.high_water[ticker] = last_timestamp
+            self.publish(ticker, pd.DataFrame(records))
+        logging.debug(f"Appended {len(all_data)} live minute bars for {len(new_bars)} tickers.")
+        return len(all_data)
+
+    async def run(self, stop=None):
+        """Poll until `stop` (an asyncio.Event) is set; sleeps outside market hours.
+
+        Each poll checks a connection out of the pool and returns it, so a dropped database connection
+        costs one poll rather than the tail. Errors are logged and the next poll retries.
+        """
+        stop = stop or asyncio.Event()
+        session = None  # open of the session the high-water marks were loaded for
+        async with httpx.AsyncClient() as async_client:
+            while not stop.is_set():
+                now = datetime.now(pytz.utc)
+                delay = 60
+                if self.market_open(now):
+                    delay = self.poll_interval
+                    try:
+                        async with self.engine.connect() as conn:
+                            session_start, _ = self.session_bounds(now.astimezone(EASTERN).date())
+                            if session != session_start:
+                                await self.load_high_water(conn, session_start)
+                                session = session_start
+                            await self.poll_once(conn, async_client)
+                    except Exception as e:
+                        logging.error(f"Live minute tail poll failed, retrying: {e}")
+                        self.failures += 1
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+
+# if __name__ == '__main__':
+#     tickers = ['AAPL', 'MSFT']
+#     key = os.getenv("API_KEY")
+
+#     tail = MinuteBarTail(tickers, engine, key)
+#     asyncio.run(tail.run())
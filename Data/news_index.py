@@ -0,0 +1,127 @@
+import logging
+import asyncio
+from sqlalchemy import select, text, tuple_, func
+from connect import engine, StockNews, NEWS_SEARCH_EXPRESSION, SENTIMENT_SCORES
+from log_config import setup_logging
+
+# Setup logging
+setup_logging()
+
+
+# Brings a stock_news table created before the search columns existed up to date.
+# Fresh databases get the same columns and indexes from create_tables().
+# Adding the stored search_vector rewrites the table once; the ALTERs run in their own short transaction
+# and are no-ops on later runs.
+COLUMNS = [
+    "ALTER TABLE stock_news ADD COLUMN IF NOT EXISTS sentiment VARCHAR(16)",
+    "ALTER TABLE stock_news ADD COLUMN IF NOT EXISTS sentiment_score SMALLINT",
+    f"ALTER TABLE stock_news ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS ({NEWS_SEARCH_EXPRESSION}) STORED",
+]
+
+# Built CONCURRENTLY so ingest keeps writing while they build; that cannot run inside a transaction
+INDEXES = {
+    'ix_stock_news_search_vector': "ON stock_news USING gin (search_vector)",
+    'ix_stock_news_tickers': "ON stock_news USING gin (tickers jsonb_path_ops)",
+    'ix_stock_news_keywords': "ON stock_news USING gin (keywords jsonb_path_ops)",
+    'ix_stock_news_published_id': "ON stock_news (published_utc, id)",
+}
+
+# An interrupted concurrent build leaves an invalid index behind, which IF NOT EXISTS would keep
+INVALID_INDEXES = """
+SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = 'stock_news'::regclass AND NOT i.indisvalid
+"""
+
+SENTIMENT_CASE = "CASE s.sentiment " + " ".join(f"WHEN '{label}' THEN {score}" for label, score in SENTIMENT_SCORES.items()) + " END"
+
+BACKFILL_SENTIMENT = f"""
+UPDATE stock_news SET
+    sentiment = s.sentiment,
+    sentiment_score = {SENTIMENT_CASE}
+FROM (
+    SELECT n.id, i ->> 'sentiment' AS sentiment
+    FROM stock_news n, jsonb_array_elements(n.insights) i
+    WHERE n.sentiment IS NULL
+      AND jsonb_typeof(n.insights) = 'array'
+      AND i ->> 'ticker' = n.ticker_queried
+) s
+WHERE stock_news.id = s.id
+"""
+
+RESULT_COLUMNS = [
+    StockNews.id, StockNews.published_utc, StockNews.ticker_queried, StockNews.id_polygon, StockNews.title,
+    StockNews.description, StockNews.author, StockNews.article_url, StockNews.tickers, StockNews.keywords,
+    StockNews.sentiment, StockNews.sentiment_score,
+]
+
+
+class NewsIndex:
+    "Indexed lookups over stock_news: full-text, tickers mentioned, keywords and sentiment"
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def ensure_indexes(self):
+        async with self.engine.begin() as conn:
+            for statement in COLUMNS:
+                await conn.execute(text(statement))
+
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            result = await conn.execute(text(INVALID_INDEXES))
+            for name in result.scalars().all():
+                if name in INDEXES:
+                    logging.info(f"Dropping invalid index {name} left by an interrupted build.")
+                    await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            for name, definition in INDEXES.items():
+                await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+
+        async with self.engine.begin() as conn:
+            result = await conn.execute(text(BACKFILL_SENTIMENT))
+        logging.info(f"News indexes in place, sentiment backfilled for {result.rowcount} rows.")
+
+    def build_query(self, search=None, ticker=None, keyword=None, ticker_queried=None, sentiment=None,
+                    since=None, until=None, cursor=None, limit=50):
+        query = select(*RESULT_COLUMNS)
+        if search:
+            query = query.where(StockNews.search_vector.bool_op('@@')(func.websearch_to_tsquery('english', search)))
+        if ticker:
+            query = query.where(StockNews.tickers.contains([ticker]))
+        if keyword:
+            query = query.where(StockNews.keywords.contains([keyword]))
+        if ticker_queried:
+            query = query.where(StockNews.ticker_queried == ticker_queried)
+        if sentiment:
+            query = query.where(StockNews.sentiment == sentiment)
+        if since:
+            query = query.where(StockNews.published_utc >= since)
+        if until:
+            query = query.where(StockNews.published_utc < until)
+        if cursor:
+            # Keyset pagination: resume strictly after the last (published_utc, id) returned
+            query = query.where(tuple_(StockNews.published_utc, StockNews.id) < tuple_(*cursor))
+        return query.order_by(StockNews.published_utc.desc(), StockNews.id.desc()).limit(limit + 1)
+
+    async def search(self, search=None, ticker=None, keyword=None, ticker_queried=None, sentiment=None,
+                     since=None, until=None, cursor=None, limit=50):
+        """Newest-first page of articles matching every filter given.
+
+        `search` is a websearch-style query over title and description, `ticker` and `keyword` match
+        the tickers/keywords arrays. Returns (rows, next_cursor); pass next_cursor back to get the
+        following page, it is None on the last page. Articles are stored once per queried ticker, so
+        filter on `ticker_queried` as well to get each article once.
+        """
+        query = self.build_query(search, ticker, keyword, ticker_queried, sentiment, since, until, cursor, limit)
+        async with self.engine.connect() as conn:
+            result = await conn.execute(query)
+            rows = [dict(row) for row in result.mappings().all()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1]['published_utc'], rows[-1]['id'])
+        return rows, next_cursor
+
+
+if __name__ == '__main__':
+    asyncio.run(NewsIndex(engine).ensure_indexes())
@@ -0,0 +1,223 @@
+import pandas as pd
+import json
+import logging
+from datetime import datetime, timezone
+from connect import RevisionHistory, INGESTED_AT_DEFAULT
+from sqlalchemy import select, text, or_, Float, Integer, DateTime, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from log_config import setup_logging
+
+# Setup logging
+setup_logging()
+
+# Bookkeeping columns that are not part of a row's values
+SYSTEM_COLUMNS = ['id', 'ingested_at']
+
+
+async def ensure_ingested_at(engine, models):
+    """Add ingested_at to tables created before it existed.
+
+    Old rows stay NULL, which as_of treats as known from the start; only new inserts get the default.
+    """
+    async with engine.begin() as conn:
+        for model in models:
+            table = model.__tablename__
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP WITHOUT TIME ZONE"))
+            await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN ingested_at SET DEFAULT {INGESTED_AT_DEFAULT.text}"))
+    logging.info(f"ingested_at in place for {len(models)} tables.")
+
+
+class RevisionTracker:
+    "Writes the rows an upsert is about to overwrite into an append-only history table"
+
+    def __init__(self, model, batch_size=1000):
+        self.model = model
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.ticker_column = model.ticker_column
+        self.key_columns = self.get_key_columns()
+        self.valid_from_column = next(c for c in self.key_columns if isinstance(self.table.c[c].type, DateTime))
+        self.extra_columns = [c for c in self.key_columns if c not in (self.ticker_column, self.valid_from_column)]
+        self.value_columns = [c.name for c in self.table.columns
+                              if c.name not in SYSTEM_COLUMNS and c.name not in self.key_columns and c.computed is None]
+
+    def get_key_columns(self):
+        for constraint in self.table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                return [c.name for c in constraint.columns]
+        raise ValueError(f"Table {self.table.name} has no unique constraint to track revisions on.")
+
+    @staticmethod
+    def _is_missing(value):
+        return not isinstance(value, (list, dict)) and pd.isna(value)
+
+    def _canonical_json(self, value):
+        if self._is_missing(value):
+            return None
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return value
+        return json.dumps(value, sort_keys=True, default=str)
+
+    def _normalize_keys(self, df):
+        df[self.valid_from_column] = pd.to_datetime(df[self.valid_from_column], errors='coerce')
+        return df
+
+    def key_extra(self, df):
+        "The non-date key columns joined into one string, '' for a missing part; stored as key_extra"
+        if not self.extra_columns:
+            return pd.Series('', index=df.index, dtype=object)
+        parts = [df[col].map(lambda v: '' if self._is_missing(v) else str(v)) for col in self.extra_columns]
+        return pd.Series(['|'.join(values) for values in zip(*parts)], index=df.index, dtype=object)
+
+    def hash_rows(self, df, columns):
+        # Cast both sides to the same dtypes so values read back from Postgres hash like freshly ingested ones
+        normalized = {}
+        for name in columns:
+            col_type = self.table.c[name].type
+            values = df[name]
+            if isinstance(col_type, (Float, Integer)):
+                normalized[name] = pd.to_numeric(values, errors='coerce').astype('float64')
+            elif isinstance(col_type, DateTime):
+                normalized[name] = pd.to_datetime(values, errors='coerce')
+            elif isinstance(col_type, JSONB):
+                normalized[name] = values.map(self._canonical_json)
+            else:
+                normalized[name] = values.map(lambda v: None if self._is_missing(v) else str(v))
+        hashes = pd.util.hash_pandas_object(pd.DataFrame(normalized, index=df.index), index=False)
+        return pd.Series(hashes.to_numpy().view('int64'), index=df.index)
+
+    async def record(self, conn, records):
+        """Compare incoming records with the stored rows and append the ones that changed to the history.
+
+        Must run on the same connection and before the upsert, so the history and the overwrite commit together.
+        """
+        if not records:
+            return 0
+
+        incoming = pd.DataFrame(records)
+        recorded_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        total = 0
+        for ticker, ticker_df in incoming.groupby(self.ticker_column, sort=False):
+            total += await self.record_ticker(conn, ticker, ticker_df, recorded_at)
+
+        if total:
+            logging.info(f"Recorded {total} revisions for {self.table.name}")
+        return total
+
+    async def record_ticker(self, conn, ticker, ticker_df, recorded_at):
+        ticker_df = self._normalize_keys(ticker_df.copy())
+        ticker_df['key_extra'] = self.key_extra(ticker_df)
+        ticker_df = ticker_df.drop_duplicates(subset=[self.valid_from_column, 'key_extra'], keep='last')
+        start, end = ticker_df[self.valid_from_column].min(), ticker_df[self.valid_from_column].max()
+        if pd.isna(start):
+            return 0
+
+        # Only the stored rows inside the incoming key range can be overwritten
+        query = select(self.table).where(
+            self.table.c[self.ticker_column] == ticker,
+            self.table.c[self.valid_from_column].between(start.to_pydatetime(), end.to_pydatetime())
+        )
+        result = await conn.execute(query)
+        existing = pd.DataFrame(result.mappings().all())
+        if existing.empty:
+            return 0
+
+        existing = self._normalize_keys(existing)
+        existing['key_extra'] = self.key_extra(existing)
+        columns = [c for c in self.value_columns if c in ticker_df.columns]
+        existing['row_hash'] = self.hash_rows(existing, columns)
+        keys = [self.valid_from_column, 'key_extra']
+        new_hashes = ticker_df[keys].assign(new_hash=self.hash_rows(ticker_df, columns))
+
+        merged = existing.merge(new_hashes, on=keys, how='inner')
+        changed = merged[merged['row_hash'] != merged['new_hash']]
+        if changed.empty:
+            return 0
+
+        payloads = json.loads(changed[self.value_columns].to_json(orient='records', date_format='iso'))
+        rows = [
+            {
+                'table_name': self.table.name,
+                'ticker': ticker,
+                'valid_from': valid_from.to_pydatetime(),
+                'key_extra': extra,
+                'row_hash': int(row_hash),
+                'payload': payload,
+                'recorded_at': recorded_at,
+            }
+            for valid_from, extra, row_hash, payload in zip(changed[self.valid_from_column], changed['key_extra'], changed['row_hash'], payloads)
+        ]
+
+        for i in range(0, len(rows), self.batch_size):
+            await conn.execute(insert(RevisionHistory.__table__).values(rows[i:i + self.batch_size]))
+
+        logging.debug(f"{len(rows)} rows restated for {ticker} in {self.table.name}")
+        return len(rows)
+
+    async def as_of(self, conn, ticker, as_of, start=None, end=None):
+        """Return the rows for a ticker as they were stored at `as_of`.
+
+        Rows first ingested after `as_of` are left out, and any row that was restated after `as_of`
+        is swapped for the earliest superseded version. `start`/`end` bound the business date.
+        Rows with no ingested_at predate the column and count as always known.
+        """
+        valid_from = self.table.c[self.valid_from_column]
+        ingested_at = self.table.c.ingested_at
+
+        query = select(self.table).where(
+            self.table.c[self.ticker_column] == ticker,
+            or_(ingested_at.is_(None), ingested_at <= as_of)
+        )
+        if start is not None:
+            query = query.where(valid_from >= start)
+        if end is not None:
+            query = query.where(valid_from <= end)
+        result = await conn.execute(query.order_by(valid_from))
+        live = pd.DataFrame(result.mappings().all())
+        if live.empty:
+            return live
+
+        history = RevisionHistory
+        history_query = (
+            select(history.valid_from, history.key_extra, history.payload)
+            .where(
+                history.table_name == self.table.name,
+                history.ticker == ticker,
+                history.recorded_at > as_of,
+            )
+            .order_by(history.valid_from, history.key_extra, history.recorded_at)
+            .distinct(history.valid_from, history.key_extra)
+        )
+        if start is not None:
+            history_query = history_query.where(history.valid_from >= start)
+        if end is not None:
+            history_query = history_query.where(history.valid_from <= end)
+        result = await conn.execute(history_query)
+        restated = result.all()
+        if not restated:
+            return live
+
+        previous = pd.DataFrame([row.payload for row in restated])
+        for name in previous.columns:
+            if isinstance(self.table.c[name].type, DateTime):
+                previous[name] = pd.to_datetime(previous[name], errors='coerce')
+        previous.index = pd.MultiIndex.from_tuples([(row.valid_from, row.key_extra) for row in restated])
+
+        live = self._normalize_keys(live)
+        live.index = pd.MultiIndex.from_arrays([live[self.valid_from_column], self.key_extra(live)])
+
+        common = live.index.intersection(previous.index)
+        live.loc[common, previous.columns] = previous.loc[common, previous.columns].to_numpy()
+        return live.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    import asyncio
+    from connect import (engine, DailyStockData, HourlyStockData, OneMinuteStockData, FiveMinuteStockData,
+                         FifteenMinuteStockData, StockSplits, StockNews, CompanyFinancials)
+
+    asyncio.run(ensure_ingested_at(engine, [DailyStockData, HourlyStockData, OneMinuteStockData, FiveMinuteStockData,
+                                            FifteenMinuteStockData, StockSplits, StockNews, CompanyFinancials]))
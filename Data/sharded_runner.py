@@ -0,0 +1,202 @@
+import pandas as pd
+import os
+import socket
+import argparse
+import logging
+import asyncio
+import datetime as dt
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from dotenv import load_dotenv
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from connect import ShardLease
+from log_config import setup_logging
+from get_company_data import CompanyFinancialsupdater
+from getstockdata import MarketDataUpdater
+from get_fin_news import NewsUpdate
+from get_stock_splits import StockSplitsupdate
+
+# Setup logging
+setup_logging()
+
+# Load environment variables
+load_dotenv()
+
+# Updaters a shard can run, resolved by name inside each worker process
+JOBS = {
+    'daily': lambda tickers, engine, key: MarketDataUpdater(tickers=tickers, engine=engine, key=key, start_date='2000-01-05'),
+    'hourly': lambda tickers, engine, key: MarketDataUpdater(tickers=tickers, engine=engine, key=key, start_date='2000-01-05', timespan='hour'),
+    'minute': lambda tickers, engine, key: MarketDataUpdater(tickers=tickers, engine=engine, key=key, start_date='2000-01-05', timespan='minute'),
+    'financials': lambda tickers, engine, key: CompanyFinancialsupdater(tickers=tickers, engine=engine, key=key),
+    'news': lambda tickers, engine, key: NewsUpdate(tickers=tickers, engine=engine, key=key),
+    'splits': lambda tickers, engine, key: StockSplitsupdate(tickers=tickers, engine=engine, key=key),
+}
+
+
+def utcnow():
+    "Naive UTC, matching the DateTime columns of shard_leases"
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_api_keys():
+    "API keys to spread shards over: API_KEYS (comma separated) if set, otherwise API_KEY"
+    keys = [k.strip() for k in os.getenv("API_KEYS", "").split(',') if k.strip()]
+    return keys or [os.getenv("API_KEY")]
+
+
+def shard_tickers(tickers, shard, shard_count):
+    "Round-robin over the sorted universe so a shard always gets the same tickers whatever the input order"
+    return sorted(set(tickers))[shard::shard_count]
+
+
+class ShardWorker:
+    "Runs one shard of a job under a lease in shard_leases, so shards can be restarted independently"
+
+    def __init__(self, job, run_id, shard, shard_count, tickers, key, lease_seconds=300):
+        self.job = job
+        self.lease_job = f"{job}:{run_id}"
+        self.shard = shard
+        self.shard_count = shard_count
+        self.tickers = tickers
+        self.key = key
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def acquire_lease(self, conn):
+        now = utcnow()
+        table = ShardLease.__table__
+        stmt = insert(table).values(
+            job=self.lease_job, shard=self.shard, shard_count=self.shard_count, owner=self.owner,
+            status='running', lease_expires=now + timedelta(seconds=self.lease_seconds), updated_at=now
+        )
+        # Take over a shard only if it is not finished and its previous owner stopped heartbeating
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['job', 'shard'],
+            set_={c: stmt.excluded[c] for c in ['shard_count', 'owner', 'status', 'lease_expires', 'updated_at']},
+            where=(table.c.status != 'done') & ((table.c.lease_expires < now) | (table.c.owner == self.owner))
+        ).returning(table.c.id)
+        result = await conn.execute(stmt)
+        acquired = result.first() is not None
+        await conn.commit()
+        return acquired
+
+    async def set_lease(self, conn, **values):
+        table = ShardLease.__table__
+        stmt = update(table).where(
+            table.c.job == self.lease_job, table.c.shard == self.shard, table.c.owner == self.owner
+        ).values(updated_at=utcnow(), **values)
+        await conn.execute(stmt)
+        await conn.commit()
+
+    async def heartbeat(self, engine):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                async with engine.connect() as conn:
+                    await self.set_lease(conn, lease_expires=utcnow() + timedelta(seconds=self.lease_seconds))
+            except Exception as e:
+                logging.error(f"Heartbeat failed for {self.lease_job} shard {self.shard}: {e}")
+
+    async def run(self):
+        # Each spawned worker re-imports connect, so this engine and its pool belong to this process.
+        # The pool is disposed at the end so a process that runs several shards starts each on a fresh loop
+        from connect import engine
+
+        try:
+            async with engine.connect() as conn:
+                if not await self.acquire_lease(conn):
+                    logging.info(f"{self.lease_job} shard {self.shard} is done or held by another worker, skipping.")
+                    return False
+
+            logging.info(f"{self.owner} running {self.lease_job} shard {self.shard}/{self.shard_count} with {len(self.tickers)} tickers.")
+            heartbeat = asyncio.create_task(self.heartbeat(engine))
+            try:
+                updater = JOBS[self.job](self.tickers, engine, self.key)
+                succeeded = await updater.update_data()
+            except Exception as e:
+                logging.error(f"{self.lease_job} shard {self.shard} failed: {e}")
+                async with engine.connect() as conn:
+                    await self.set_lease(conn, status='failed', lease_expires=utcnow())
+                raise
+            finally:
+                heartbeat.cancel()
+
+            # Updaters log and swallow fetch/write errors, so their return value is the only failure signal
+            if not succeeded:
+                logging.error(f"{self.lease_job} shard {self.shard} finished with {updater.failures} errors, leaving it for a rerun.")
+                async with engine.connect() as conn:
+                    await self.set_lease(conn, status='failed', lease_expires=utcnow())
+                return False
+
+            async with engine.connect() as conn:
+                await self.set_lease(conn, status='done')
+            logging.info(f"{self.lease_job} shard {self.shard} done.")
+            return True
+        finally:
+            await engine.dispose()
+
+
+def run_shard(job, run_id, shard, shard_count, tickers, key, lease_seconds):
+    "Process entry point: one event loop per shard"
+    worker = ShardWorker(job, run_id, shard, shard_count, shard_tickers(tickers, shard, shard_count), key, lease_seconds)
+    return asyncio.run(worker.run())
+
+
+def run_sharded(job, tickers, shard_count, processes=None, shards=None, run_id=None, lease_seconds=300):
+    """Split tickers into shard_count shards and run them over a pool of worker processes.
+
+    `shards` restricts this node to a subset of shard ids, so the same job can be spread over several
+    machines pointing at the same database. API keys are assigned to shards round-robin.
+    """
+    if job not in JOBS:
+        raise ValueError(f"Job {job} is not valid. Valid jobs are {', '.join(JOBS)}.")
+
+    run_id = run_id or dt.date.today().isoformat()
+    shards = list(shards) if shards is not None else list(range(shard_count))
+    processes = processes or min(len(shards), os.cpu_count() or 1)
+    keys = get_api_keys()
+
+    results = {}
+    # spawn, not fork: a forked child would inherit the parent's connections and event loop state
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {
+            pool.submit(run_shard, job, run_id, shard, shard_count, tickers, keys[shard % len(keys)], lease_seconds): shard
+            for shard in shards
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                results[shard] = future.result()
+            except Exception as e:
+                logging.error(f"Shard {shard} of {job} raised: {e}")
+                results[shard] = False
+    return results
+
+
+def load_universe(name):
+    wiki = 'http://en.wikipedia.org/wiki'
+    if name == 'sp500':
+        return pd.read_html(wiki + '/List_of_S%26P_500_companies')[0].Symbol.to_list()
+    if name == 'djia':
+        return pd.read_html(wiki + '/Dow_Jones_Industrial_Average')[1].Symbol.to_list()
+    raise ValueError(f"Universe {name} is not valid. Valid universes are sp500, djia.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run an updater sharded across processes.")
+    parser.add_argument('job', choices=list(JOBS))
+    parser.add_argument('--tickers', nargs='+', help="Tickers to update, overrides --universe")
+    parser.add_argument('--universe', default='sp500', choices=['sp500', 'djia'])
+    parser.add_argument('--shard-count', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, nargs='+', help="Shard ids to run on this node, defaults to all")
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--run-id', help="Lease namespace, defaults to today's date. Reuse it to resume a run.")
+    parser.add_argument('--lease-seconds', type=int, default=300)
+    args = parser.parse_args()
+
+    tickers = args.tickers or load_universe(args.universe)
+    results = run_sharded(args.job, tickers, args.shard_count, processes=args.processes, shards=args.shards,
+                          run_id=args.run_id, lease_seconds=args.lease_seconds)
+    logging.info(f"Sharded {args.job} run finished: {results}")